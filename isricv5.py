@@ -1,21 +1,66 @@
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+import orjson
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import atexit
+import math
+import hashlib
+import queue
+import threading
+import time
+import rtree
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 from datetime import datetime, timedelta, timezone
 from flask_cors import CORS
+from flask_caching import Cache
+from apscheduler.schedulers.background import BackgroundScheduler
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
 
 
 # Load environment variables from .env file
 load_dotenv()
 API_KEY = os.getenv("API_KEY")
 
+# JSON provider backed by orjson for faster response serialization
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///soil_data.db'
+app.json = OrjsonProvider(app)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL", 'sqlite:///soil_data.db')
+app.config['CACHE_TYPE'] = os.getenv("CACHE_TYPE", "SimpleCache")  # Use RedisCache in production
+app.config['CACHE_REDIS_URL'] = os.getenv("CACHE_REDIS_URL")
 db = SQLAlchemy(app)
+cache = Cache(app)
 CORS(app)
 
+SOIL_CACHE_TIMEOUT = 24 * 60 * 60  # Soil properties are effectively static
+WEATHER_CACHE_TIMEOUT = 10 * 60
+STALE_AFTER = timedelta(days=2)  # Records older than this are refetched
+
+# Pooled HTTP session so TLS connections are reused across requests
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=20, pool_maxsize=50))
+
+# Only request the soil properties we actually use
+SOIL_PROPERTIES = ('nitrogen', 'phh2o', 'wv0010', 'cec')
+SOIL_PROPERTY_PARAMS = '&'.join(f'property={p}' for p in SOIL_PROPERTIES)
+
 
 # Database model for storing soil data
 class SoilData(db.Model):
@@ -33,116 +78,236 @@ class SoilData(db.Model):
     predictions = db.Column(db.String, nullable=False)
     date_recorded = db.Column(db.DateTime, default=datetime.now(timezone.utc))  # New date column
 
-# Initialize the database
+    # Composite index so the bounding-box lookup can use range scans
+    __table_args__ = (db.Index('ix_soil_latlon', 'lat', 'lon'),)
+
+# In-memory R-Tree over (lon, lat) points for nearest-neighbour lookups
+spatial_idx = rtree.index.Index()
+spatial_lock = threading.Lock()
+
+# SQLite settings so readers are not blocked by writers
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+    "cache_size=-65536",
+)
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+# Initialize the database and load existing coordinates into the spatial index
 with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, "connect", set_sqlite_pragmas)
     db.create_all()
+    # create_all() skips indexes on tables that already exist
+    for ix in SoilData.__table__.indexes:
+        ix.create(db.engine, checkfirst=True)
+    for r in SoilData.query.with_entities(SoilData.id, SoilData.lat, SoilData.lon).all():
+        spatial_idx.insert(r.id, (r.lon, r.lat, r.lon, r.lat))
+
+# Function to delete stale records in a single query
+def purge_stale_records():
+    with app.app_context():
+        cutoff = datetime.now(timezone.utc) - STALE_AFTER
+        stale = SoilData.query.filter(SoilData.date_recorded < cutoff)
+        # Load the rows first so lookups are not blocked on the query
+        rows = stale.with_entities(SoilData.id, SoilData.lat, SoilData.lon).all()
+        with spatial_lock:
+            for r in rows:
+                spatial_idx.delete(r.id, (r.lon, r.lat, r.lon, r.lat))
+        stale.delete(synchronize_session=False)
+        db.session.commit()
+
+# Only the worker process holding this lock runs the purge job
+os.makedirs(app.instance_path, exist_ok=True)
+purge_lock = open(os.path.join(app.instance_path, 'purge.lock'), 'a')
+if fcntl is not None:
+    try:
+        fcntl.flock(purge_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        purge_lock.close()
+        purge_lock = None
+
+# Purge stale records hourly, starting immediately
+if purge_lock is not None:
+    scheduler = BackgroundScheduler(daemon=True)
+    scheduler.add_job(purge_stale_records, 'interval', hours=1, next_run_time=datetime.now())
+    scheduler.start()
 
 # Function to get soil data from SoilGrids API
 def get_soil_data(lat, lon):
-    url = f"https://rest.isric.org/soilgrids/v2.0/properties/query?lat={lat}&lon={lon}&depth=0-5cm"
-    response = requests.get(url)
+    # Round to ~100 m so nearby requests share a cache entry
+    lat, lon = round(lat, 3), round(lon, 3)
+    cache_key = f"soil:{lat:.3f}:{lon:.3f}"
+    soil_data = cache.get(cache_key)
+    if soil_data is not None:
+        return soil_data
+
+    url = f"https://rest.isric.org/soilgrids/v2.0/properties/query?lat={lat}&lon={lon}&depth=0-5cm&{SOIL_PROPERTY_PARAMS}"
+    response = http_session.get(url, timeout=10)
     
     if response.status_code == 200:
-        soil_data = response.json()['properties']['layers']
+        # Key layers by name for direct lookups
+        soil_data = {layer['name']: layer for layer in response.json()['properties']['layers']}
         
         # Check for null values in the soil data
-        if all(value is None for layer in soil_data for value in layer.values()):
+        if all(value is None for layer in soil_data.values() for value in layer.values()):
             return {"error": "Data returned is null. Please try again later."}
         
+        cache.set(cache_key, soil_data, timeout=SOIL_CACHE_TIMEOUT)
         return soil_data
     else:
         return {"error": f"Failed to fetch data: {response.status_code}"}
 
 # Function to get weather data
 def get_weather_data(lat, lon):
+    lat, lon = round(lat, 3), round(lon, 3)
+    cache_key = f"weather:{lat:.3f}:{lon:.3f}"
+    weather_data = cache.get(cache_key)
+    if weather_data is not None:
+        return weather_data
+
     weather_url = f"https://api.weatherapi.com/v1/forecast.json?key={API_KEY}&q={lat},{lon}&days=5&aqi=no&alerts=no"
-    response = requests.get(weather_url)
+    response = http_session.get(weather_url, timeout=10)
     if response.status_code == 200:
-        return response.json()['forecast']['forecastday']
+        weather_data = response.json()['forecast']['forecastday']
+        cache.set(cache_key, weather_data, timeout=WEATHER_CACHE_TIMEOUT)
+        return weather_data
     else:
         return None
 
+# Thread pool shared by all requests for the upstream API calls
+fetch_pool = ThreadPoolExecutor(max_workers=20)
+# Separate pool for batch requests so large batches cannot starve /api/analyze
+batch_fetch_pool = ThreadPoolExecutor(max_workers=20)
+
+# Function to fetch soil and weather data concurrently
+def fetch_soil_and_weather(lat, lon):
+    soil_future = fetch_pool.submit(get_soil_data, lat, lon)
+    weather_future = fetch_pool.submit(get_weather_data, lat, lon)
+    return soil_future.result(), weather_future.result()
+
+# Constant recommendation messages
+REC_NITROGEN = "Consider adding nitrogen-based fertilizers."
+REC_MOISTURE = "Soil moisture is low. Increase irrigation."
+REC_PH_OPTIMAL = "Soil pH is within the optimal range."
+REC_PH_LOW = "Consider adding lime to raise the pH."
+REC_PH_HIGH = "Consider adding sulfur to lower the pH."
+REC_CEC_OPTIMAL = "CEC is within the optimal range."
+
+# Weather messages are cached by the average scaled to tenths
+@lru_cache(maxsize=1024)
+def rain_message(avg_rain_x10):
+    return f"High average chance of rain ({avg_rain_x10 / 10:.1f}%). Delay irrigation."
+
+@lru_cache(maxsize=1024)
+def wind_message(avg_wind_x10):
+    return f"Strong winds expected ({avg_wind_x10 / 10:.1f} kph). Protect crops."
+
+# Function to average rain chance and wind speed over the forecast days
+def weather_averages(weather_data):
+    count = len(weather_data)
+    rain = np.fromiter((d['day']['daily_chance_of_rain'] for d in weather_data), np.float32, count)
+    wind = np.fromiter((d['day']['maxwind_kph'] for d in weather_data), np.float32, count)
+    return float(rain.mean()), float(wind.mean())
+
 # Function to generate recommendations
 def generate_recommendations(soil_data, weather_data):
     nitrogen = soil_data.get('nitrogen', 0)
     moisture = soil_data.get('wv0010', 0)
     ph = soil_data.get('phh2o', 0) / 10
     cec = soil_data.get('cec', 0)
-    recommendations = set()
+    recommendations = []
     
     if nitrogen < 100:
-        recommendations.add("Consider adding nitrogen-based fertilizers.")
+        recommendations.append(REC_NITROGEN)
     if moisture < 0.2:
-        recommendations.add("Soil moisture is low. Increase irrigation.")
+        recommendations.append(REC_MOISTURE)
     if 6 < ph < 7.5:
-        recommendations.add("Soil pH is within the optimal range.")
+        recommendations.append(REC_PH_OPTIMAL)
     elif ph < 6:
-        recommendations.add("Consider adding lime to raise the pH.")
+        recommendations.append(REC_PH_LOW)
     elif ph > 7.5:
-        recommendations.add("Consider adding sulfur to lower the pH.")
+        recommendations.append(REC_PH_HIGH)
     if cec >= 10:
-        recommendations.add("CEC is within the optimal range.")
+        recommendations.append(REC_CEC_OPTIMAL)
     
     if weather_data:
-        avg_rain = sum(day['day']['daily_chance_of_rain'] for day in weather_data) / len(weather_data)
-        avg_wind = sum(day['day']['maxwind_kph'] for day in weather_data) / len(weather_data)
+        avg_rain, avg_wind = weather_averages(weather_data)
         if avg_rain > 50:
-            recommendations.add(f"High average chance of rain ({avg_rain:.1f}%). Delay irrigation.")
+            recommendations.append(rain_message(round(avg_rain * 10)))
         if avg_wind > 20:
-            recommendations.add(f"Strong winds expected ({avg_wind:.1f} kph). Protect crops.")
+            recommendations.append(wind_message(round(avg_wind * 10)))
     
-    return list(recommendations)
+    return recommendations
 
-# Helper function to find closest coordinates in the database
+NEAREST_CANDIDATES = 4  # Index hits checked before falling back to SQL
+
+# Helper function to find the closest fresh record in the database
 def find_closest_coordinates(lat, lon, threshold=0.5):
-    records = SoilData.query.all()
-    for record in records:
-        if abs(record.lat - lat) <= threshold and abs(record.lon - lon) <= threshold:
+    cutoff = datetime.now(timezone.utc) - STALE_AFTER
+    in_range = (SoilData.lat.between(lat - threshold, lat + threshold),
+                SoilData.lon.between(lon - threshold, lon + threshold),
+                SoilData.date_recorded >= cutoff)
+    distance = (SoilData.lat - lat) * (SoilData.lat - lat) + (SoilData.lon - lon) * (SoilData.lon - lon)
+
+    with spatial_lock:
+        hits = {item.id: item.bbox for item in
+                spatial_idx.nearest((lon, lat, lon, lat), NEAREST_CANDIDATES, objects=True)}
+    # Only hits inside the threshold box can match, so skip SQL for the rest
+    in_box = {rid: bbox for rid, bbox in hits.items()
+              if lon - threshold <= bbox[0] <= lon + threshold
+              and lat - threshold <= bbox[1] <= lat + threshold}
+    if in_box:
+        record = SoilData.query.filter(SoilData.id.in_(in_box), *in_range).order_by(distance).first()
+        if record:
             return record
-    return None
+        # In-box hits rejected by SQL were purged or went stale, e.g. via another worker's purge job
+        with spatial_lock:
+            for rid, bbox in in_box.items():
+                spatial_idx.delete(rid, bbox)
 
-# Route to handle GET request and analyze soil data
-@app.route('/api/analyze', methods=['GET'])
-def analyze_soil():
-    lat = float(request.args.get('lat'))
-    lon = float(request.args.get('lon'))
+    # Rows written by other worker processes are missing from this process's index
+    record = SoilData.query.filter(*in_range).order_by(distance).first()
+    if record:
+        point = (record.lon, record.lat, record.lon, record.lat)
+        with spatial_lock:
+            spatial_idx.delete(record.id, point)
+            spatial_idx.insert(record.id, point)
+    return record
 
-    # Check if similar coordinates exist
-    existing_record = find_closest_coordinates(lat, lon)
-    if existing_record:
-        if existing_record.date_recorded.tzinfo is None:
-            existing_record.date_recorded = existing_record.date_recorded.replace(tzinfo=timezone.utc)
-        # Check if the record is older than 2 days
-        if datetime.now(timezone.utc) - existing_record.date_recorded > timedelta(days=2):
-            db.session.delete(existing_record)  # Delete the old record
-            db.session.commit()  # Commit the deletion
-        else:
-            return jsonify({
-                'status': 'found',
-                'message': 'Using existing data from the database.',
-                'soil_data': {
-                    'nitrogen': f"{existing_record.nitrogen} g/kg",
-                    'nitrogen_uncertainty': f"{existing_record.nitrogen_uncertainty} ",
-                    'ph': f"{existing_record.ph} pH",
-                    'moisture': f"{existing_record.moisture} cm³/cm³",
-                    'cec': f"{existing_record.cec} cmol(c)/kg",
-                    'temperature': f"{existing_record.temperature} °C",
-                    'humidity': f"{existing_record.humidity} %"
-                },
-                'predictions': existing_record.predictions,
-                'recommendations': existing_record.recommendations
-            })
+# Helper function to check that coordinates are finite and in range
+def valid_coordinates(lat, lon):
+    return (math.isfinite(lat) and math.isfinite(lon)
+            and -90 <= lat <= 90 and -180 <= lon <= 180)
 
-    # Fetch soil data and weather data
-    soil_data = get_soil_data(lat, lon)
-    weather_data = get_weather_data(lat, lon)
-    if not soil_data or not weather_data:
-        return jsonify({'error': 'Failed to fetch data.'}), 500
+# Helper function to build a cacheable JSON response for a record
+def cached_response(payload, lat, lon, date_recorded, max_age=3600):
+    response = jsonify(payload)
+    # date_recorded may come back naive from SQLite, so format it without tzinfo
+    recorded = date_recorded.strftime('%Y-%m-%dT%H:%M:%S.%f')
+    etag = hashlib.md5(f"{payload['status']}:{lat}:{lon}:{recorded}".encode()).hexdigest()
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    # Turns the response into a 304 when If-None-Match matches
+    return response.make_conditional(request)
+
+# Helper function to build a new record from the fetched soil and weather data
+def build_record(lat, lon, soil_data, weather_data):
+    if not soil_data or 'error' in soil_data or not weather_data:
+        return None
 
-    nitrogen_layer = next((layer for layer in soil_data if layer['name'] == 'nitrogen'), None)
-    phh2o_layer = next((layer for layer in soil_data if layer['name'] == 'phh2o'), None)
-    wv0010_layer = next((layer for layer in soil_data if layer['name'] == 'wv0010'), None)
-    cec_layer = next((layer for layer in soil_data if layer['name'] == 'cec'), None)
+    nitrogen_layer = soil_data.get('nitrogen')
+    phh2o_layer = soil_data.get('phh2o')
+    wv0010_layer = soil_data.get('wv0010')
+    cec_layer = soil_data.get('cec')
 
     # Retrieve nitrogen values
     if nitrogen_layer:
@@ -157,44 +322,213 @@ def analyze_soil():
     phh2o = phh2o_layer['depths'][0]['values'].get('mean') if phh2o_layer else None
     wv0010 = wv0010_layer['depths'][0]['values'].get('mean') if wv0010_layer else None
     cec = cec_layer['depths'][0]['values'].get('mean') if cec_layer else None
+    temperature = weather_data[0]['day']['avgtemp_c']
+    humidity = weather_data[0]['day']['avghumidity']
+
+    # Every column is NOT NULL, so null upstream values cannot be stored
+    if None in (nitrogen, nitrogen_uncertainty, phh2o, wv0010, cec, temperature, humidity):
+        return None
 
-    # Store the new record in the database
-    new_record = SoilData(
-        lat=lat,
-        lon=lon,
-        nitrogen=nitrogen,
-        nitrogen_uncertainty=nitrogen_uncertainty,
-        ph=phh2o,
-        moisture=wv0010,
-        temperature=weather_data[0]['day']['avgtemp_c'],
-        humidity=weather_data[0]['day']['avghumidity'],
-        cec=cec,
-        recommendations="; ".join(generate_recommendations({
+    return {
+        'lat': lat,
+        'lon': lon,
+        'nitrogen': nitrogen,
+        'nitrogen_uncertainty': nitrogen_uncertainty,
+        'ph': phh2o,
+        'moisture': wv0010,
+        'temperature': temperature,
+        'humidity': humidity,
+        'cec': cec,
+        'recommendations': "; ".join(generate_recommendations({
             'nitrogen': nitrogen,
             'wv0010': wv0010,
             'phh2o': phh2o,
             'cec': cec
         }, weather_data)),
-        predictions="",  # Add prediction logic if needed
-        date_recorded=datetime.now(timezone.utc)
-    )
-    
-    db.session.add(new_record)
-    db.session.commit()
+        'predictions': "",  # Add prediction logic if needed
+        'date_recorded': datetime.now(timezone.utc)
+    }
+
+# New records are queued and written in batches by a background thread
+write_queue = queue.Queue()
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_WINDOW = 0.05  # Seconds to wait for more records before flushing
+
+# Function to insert records and add them to the spatial index, returning the stored ones
+def store_records(batch):
+    with app.app_context():
+        try:
+            # return_defaults fills in the generated ids for the spatial index
+            db.session.bulk_insert_mappings(SoilData, batch, return_defaults=True)
+            db.session.commit()
+            stored = batch
+        except SQLAlchemyError:
+            db.session.rollback()
+            app.logger.exception("Failed to store %d soil records, retrying one at a time", len(batch))
+            # Retry each row on its own so one bad row cannot drop the others
+            stored = []
+            for record in batch:
+                record.pop('id', None)
+                try:
+                    db.session.bulk_insert_mappings(SoilData, [record], return_defaults=True)
+                    db.session.commit()
+                    stored.append(record)
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    app.logger.exception("Dropping soil record for %s, %s", record['lat'], record['lon'])
+    with spatial_lock:
+        for record in stored:
+            spatial_idx.insert(record['id'], (record['lon'], record['lat'], record['lon'], record['lat']))
+    return stored
+
+def flush_writes():
+    while True:
+        batch = [write_queue.get()]
+        deadline = time.monotonic() + WRITE_BATCH_WINDOW
+        while len(batch) < WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(write_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            store_records(batch)
+        except Exception:
+            # Keep the writer alive whatever happens to a single batch
+            app.logger.exception("Soil record writer failed")
+        finally:
+            for _ in batch:
+                write_queue.task_done()
+
+# Function to store queued records on shutdown, e.g. when a worker is recycled
+def drain_writes():
+    batch = []
+    while True:
+        try:
+            batch.append(write_queue.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        try:
+            store_records(batch)
+        finally:
+            for _ in batch:
+                write_queue.task_done()
+    # Wait for any batch the writer thread is still storing
+    write_queue.join()
+
+threading.Thread(target=flush_writes, daemon=True).start()
+atexit.register(drain_writes)
 
-    return jsonify({
+# Response body for a record found in the database
+def found_payload(record):
+    return {
+        'status': 'found',
+        'message': 'Using existing data from the database.',
+        'soil_data': {
+            'nitrogen': f"{record.nitrogen} g/kg",
+            'nitrogen_uncertainty': f"{record.nitrogen_uncertainty} ",
+            'ph': f"{record.ph} pH",
+            'moisture': f"{record.moisture} cm³/cm³",
+            'cec': f"{record.cec} cmol(c)/kg",
+            'temperature': f"{record.temperature} °C",
+            'humidity': f"{record.humidity} %"
+        },
+        'predictions': record.predictions,
+        'recommendations': record.recommendations
+    }
+
+# Response body for a freshly fetched record
+def success_payload(record):
+    return {
         'status': 'success',
         'soil_data': {
-            'nitrogen': f"{nitrogen} g/kg",
-            'nitrogen_uncertainty': f"{nitrogen_uncertainty} ",
-            'ph': f"{phh2o/10} pH",
-            'moisture': f"{wv0010} cm³/cm³",
-            'cec': f"{cec} cmol(c)/kg",
-            'temperature': f"{weather_data[0]['day']['avgtemp_c']} °C",
-            'humidity': f"{weather_data[0]['day']['avghumidity']} %"
+            'nitrogen': f"{record['nitrogen']} g/kg",
+            'nitrogen_uncertainty': f"{record['nitrogen_uncertainty']} ",
+            'ph': f"{record['ph']/10} pH",
+            'moisture': f"{record['moisture']} cm³/cm³",
+            'cec': f"{record['cec']} cmol(c)/kg",
+            'temperature': f"{record['temperature']} °C",
+            'humidity': f"{record['humidity']} %"
         },
-        'recommendations': new_record.recommendations
-    })
+        'recommendations': record['recommendations']
+    }
+
+# Route to handle GET request and analyze soil data
+@app.route('/api/analyze', methods=['GET'])
+def analyze_soil():
+    lat = float(request.args.get('lat'))
+    lon = float(request.args.get('lon'))
+    if not valid_coordinates(lat, lon):
+        return jsonify({'error': 'lat must be within -90..90 and lon within -180..180.'}), 400
+
+    # Check if similar coordinates exist
+    existing_record = find_closest_coordinates(lat, lon)
+    if existing_record:
+        return cached_response(found_payload(existing_record), existing_record.lat,
+                               existing_record.lon, existing_record.date_recorded)
+
+    # Fetch soil data and weather data
+    soil_data, weather_data = fetch_soil_and_weather(lat, lon)
+    new_record = build_record(lat, lon, soil_data, weather_data)
+    if new_record is None:
+        return jsonify({'error': 'Failed to fetch data.'}), 500
+
+    # Queue the new record for the background writer
+    write_queue.put(dict(new_record))
+
+    return cached_response(success_payload(new_record), lat, lon, new_record['date_recorded'])
+
+MAX_BATCH_SIZE = 100
+
+# Route to handle POST request and analyze a batch of coordinates
+@app.route('/api/analyze_batch', methods=['POST'])
+def analyze_batch():
+    coords = request.get_json(silent=True)
+    if not isinstance(coords, list) or len(coords) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Expected a list of at most {MAX_BATCH_SIZE} coordinates.'}), 400
+    try:
+        coords = [(float(c['lat']), float(c['lon'])) for c in coords]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each coordinate needs numeric lat and lon.'}), 400
+    if not all(valid_coordinates(lat, lon) for lat, lon in coords):
+        return jsonify({'error': 'lat must be within -90..90 and lon within -180..180.'}), 400
+
+    # Look up and fetch each distinct coordinate only once
+    positions = {}
+    for i, coord in enumerate(coords):
+        positions.setdefault(coord, []).append(i)
+
+    results = {}
+    pending = []
+    for lat, lon in positions:
+        existing_record = find_closest_coordinates(lat, lon)
+        if existing_record:
+            results[(lat, lon)] = found_payload(existing_record)
+        else:
+            # The batch pool bounds how many upstream calls run at once
+            pending.append((lat, lon,
+                            batch_fetch_pool.submit(get_soil_data, lat, lon),
+                            batch_fetch_pool.submit(get_weather_data, lat, lon)))
+
+    for lat, lon, soil_future, weather_future in pending:
+        try:
+            new_record = build_record(lat, lon, soil_future.result(), weather_future.result())
+        except (KeyError, IndexError, TypeError):
+            # Malformed or null upstream data only fails this coordinate
+            app.logger.exception("Failed to parse data for %s, %s", lat, lon)
+            new_record = None
+        if new_record is None:
+            results[(lat, lon)] = {'lat': lat, 'lon': lon, 'error': 'Failed to fetch data.'}
+        else:
+            # The background writer stores queued records in batches
+            write_queue.put(dict(new_record))
+            results[(lat, lon)] = success_payload(new_record)
+
+    return jsonify([results[coord] for coord in coords])
 
-if __name__ == '__main__':
+# Development server only; deploy with gunicorn (see Procfile)
+if __name__ == '__main__' and os.getenv("DEV"):
     app.run(debug=True)
@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Point the app at a throwaway database before it is imported
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import isricv5  # noqa: E402
+
+
+def indexed_ids():
+    with isricv5.spatial_lock:
+        return set(isricv5.spatial_idx.intersection((-180, -90, 180, 90)))
+
+
+@pytest.fixture
+def app_module():
+    # Start every test with an empty table, spatial index and cache
+    isricv5.cache.clear()
+    with isricv5.app.app_context():
+        isricv5.SoilData.query.delete()
+        isricv5.db.session.commit()
+    with isricv5.spatial_lock:
+        for item in list(isricv5.spatial_idx.intersection((-180, -90, 180, 90), objects=True)):
+            isricv5.spatial_idx.delete(item.id, item.bbox)
+    return isricv5
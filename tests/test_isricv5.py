@@ -0,0 +1,238 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+
+from conftest import indexed_ids
+
+
+def make_record(lat, lon, **overrides):
+    record = {
+        'lat': lat,
+        'lon': lon,
+        'nitrogen': 80.0,
+        'nitrogen_uncertainty': 5.0,
+        'ph': 65.0,
+        'moisture': 0.3,
+        'cec': 12.0,
+        'temperature': 20.0,
+        'humidity': 50.0,
+        'recommendations': '',
+        'predictions': '',
+        'date_recorded': datetime.now(timezone.utc),
+    }
+    record.update(overrides)
+    return record
+
+
+def make_soil(**means):
+    values = {'nitrogen': 80, 'phh2o': 65, 'wv0010': 0.3, 'cec': 12}
+    values.update(means)
+    return {name: {'name': name, 'depths': [{'values': {'mean': mean, 'uncertainty': 5}}]}
+            for name, mean in values.items()}
+
+
+WEATHER = [{'day': {'daily_chance_of_rain': 10, 'maxwind_kph': 5,
+                    'avgtemp_c': 20, 'avghumidity': 50}}] * 5
+
+
+def wait_for_rows(app_module, count, timeout=2):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with app_module.app.app_context():
+            if app_module.SoilData.query.count() >= count:
+                return
+        time.sleep(0.02)
+
+
+def test_store_records_keeps_good_rows_when_one_fails(app_module):
+    good = make_record(1.0, 1.0)
+    bad = make_record(2.0, 2.0, nitrogen_uncertainty=None)
+
+    stored = app_module.store_records([good, bad])
+
+    assert stored == [good]
+    with app_module.app.app_context():
+        assert [(r.lat, r.lon) for r in app_module.SoilData.query] == [(1.0, 1.0)]
+    assert indexed_ids() == {good['id']}
+
+
+def test_drain_writes_stores_queued_records(app_module):
+    for lat in (1.0, 2.0, 3.0):
+        app_module.write_queue.put(make_record(lat, lat))
+
+    app_module.drain_writes()
+
+    assert app_module.write_queue.unfinished_tasks == 0
+    with app_module.app.app_context():
+        assert sorted(r.lat for r in app_module.SoilData.query) == [1.0, 2.0, 3.0]
+    assert len(indexed_ids()) == 3
+
+
+def test_build_record_rejects_null_values(app_module):
+    soil = make_soil()
+    soil['nitrogen']['depths'][0]['values']['uncertainty'] = None
+
+    assert app_module.build_record(1.0, 1.0, soil, WEATHER) is None
+    assert app_module.build_record(1.0, 1.0, make_soil(phh2o=None), WEATHER) is None
+
+
+def test_purge_removes_stale_rows_from_index(app_module):
+    stale = make_record(1.0, 1.0, date_recorded=datetime.now(timezone.utc) - timedelta(days=3))
+    fresh = make_record(5.0, 5.0)
+    app_module.store_records([stale, fresh])
+
+    app_module.purge_stale_records()
+
+    with app_module.app.app_context():
+        assert [r.id for r in app_module.SoilData.query] == [fresh['id']]
+    assert indexed_ids() == {fresh['id']}
+
+
+def test_find_closest_skips_dangling_index_ids(app_module):
+    app_module.store_records([make_record(9.3, 9.3)])
+    # An id whose row was deleted by another process
+    app_module.spatial_idx.insert(10_000, (9.0, 9.0, 9.0, 9.0))
+
+    with app_module.app.app_context():
+        record = app_module.find_closest_coordinates(9.1, 9.1)
+        assert (record.lat, record.lon) == (9.3, 9.3)
+
+
+def test_find_closest_uses_rows_missing_from_index(app_module):
+    with app_module.app.app_context():
+        app_module.db.session.add(app_module.SoilData(**make_record(20.0, 20.0)))
+        app_module.db.session.commit()
+        record = app_module.find_closest_coordinates(20.2, 20.2)
+
+    assert (record.lat, record.lon) == (20.0, 20.0)
+    assert indexed_ids() == {record.id}
+
+
+def count_queries(app_module, lookup):
+    statements = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+        event.listen(engine, 'before_cursor_execute', record_statement)
+        try:
+            result = lookup()
+        finally:
+            event.remove(engine, 'before_cursor_execute', record_statement)
+    return result, len(statements)
+
+
+def test_find_closest_query_counts(app_module):
+    app_module.store_records([make_record(1.0, 1.0)])
+    find = app_module.find_closest_coordinates
+
+    # A miss with no index hit near the point goes straight to the fallback query
+    assert count_queries(app_module, lambda: find(50.0, 50.0)) == (None, 1)
+
+    record, queries = count_queries(app_module, lambda: find(1.1, 1.1))
+    assert (record.lat, queries) == (1.0, 1)
+
+    # A dangling in-box hit costs one extra query and is dropped from the index
+    app_module.spatial_idx.insert(10_000, (30.0, 30.0, 30.0, 30.0))
+    assert count_queries(app_module, lambda: find(30.1, 30.1)) == (None, 2)
+    assert 10_000 not in indexed_ids()
+
+
+def test_analyze_batch_with_mixed_items(app_module, monkeypatch):
+    soil_by_coord = {
+        (10.0, 10.0): make_soil(),
+        (30.0, 30.0): make_soil(phh2o=None),  # null mean, e.g. over water
+        (40.0, 40.0): {'cec': {'name': 'cec', 'depths': []}},  # malformed layer
+    }
+    soil_calls = []
+
+    def fake_soil(lat, lon):
+        soil_calls.append((lat, lon))
+        return soil_by_coord.get((lat, lon), {'error': 'Failed to fetch data: 500'})
+
+    monkeypatch.setattr(app_module, 'get_soil_data', fake_soil)
+    monkeypatch.setattr(app_module, 'get_weather_data', lambda lat, lon: WEATHER)
+
+    coords = [(10.0, 10.0), (20.0, 20.0), (30.0, 30.0), (40.0, 40.0), (10.0, 10.0)]
+    response = app_module.app.test_client().post(
+        '/api/analyze_batch', json=[{'lat': lat, 'lon': lon} for lat, lon in coords])
+
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [r.get('status', 'error') for r in results] == ['success', 'error', 'error', 'error', 'success']
+    assert results[1] == {'lat': 20.0, 'lon': 20.0, 'error': 'Failed to fetch data.'}
+    assert sorted(soil_calls) == sorted(set(coords))
+
+    wait_for_rows(app_module, 1)
+    with app_module.app.app_context():
+        assert [(r.lat, r.lon) for r in app_module.SoilData.query] == [(10.0, 10.0)]
+
+
+def test_analyze_batch_rejects_bad_input(app_module):
+    client = app_module.app.test_client()
+
+    assert client.post('/api/analyze_batch', json={'lat': 1}).status_code == 400
+    assert client.post('/api/analyze_batch', json=[{'lat': 'x', 'lon': 1}]).status_code == 400
+    assert client.post('/api/analyze_batch', json=[{'lat': 'nan', 'lon': 'inf'}]).status_code == 400
+    assert client.post('/api/analyze_batch', json=[{'lat': 'inf', 'lon': '1'}]).status_code == 400
+    assert client.post('/api/analyze_batch', json=[{'lat': 91, 'lon': 0}]).status_code == 400
+    assert client.post('/api/analyze_batch', json=[{'lat': 0, 'lon': -181}]).status_code == 400
+    assert client.get('/api/analyze?lat=nan&lon=1').status_code == 400
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+def test_upstream_responses_are_cached_by_rounded_coordinates(app_module, monkeypatch):
+    urls = []
+
+    def fake_get(url, timeout):
+        urls.append(url)
+        if 'soilgrids' in url:
+            return FakeResponse({'properties': {'layers': list(make_soil().values())}})
+        return FakeResponse({'forecast': {'forecastday': WEATHER}})
+
+    monkeypatch.setattr(app_module.http_session, 'get', fake_get)
+
+    soil = app_module.get_soil_data(1.23456, 2.34567)
+    # Rounds to the same 3-decimal cell, so both calls are cache hits
+    assert app_module.get_soil_data(1.2351, 2.3461) == soil
+    assert app_module.get_weather_data(1.23456, 2.34567) == WEATHER
+    assert app_module.get_weather_data(1.2351, 2.3461) == WEATHER
+
+    assert len(urls) == 2
+    assert 'lat=1.235&lon=2.346' in urls[0] and 'q=1.235,2.346' in urls[1]
+    assert app_module.cache.get('soil:1.235:2.346') == soil
+    assert app_module.cache.get('weather:1.235:2.346') == WEATHER
+
+
+def test_analyze_sets_cache_headers_and_returns_304(app_module):
+    app_module.store_records([make_record(1.0, 1.0)])
+    client = app_module.app.test_client()
+
+    response = client.get('/api/analyze?lat=1.1&lon=1.1')
+
+    assert response.status_code == 200
+    assert response.get_json()['status'] == 'found'
+    etag = response.headers['ETag']
+    assert etag
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 3600
+
+    cached = client.get('/api/analyze?lat=1.1&lon=1.1', headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag
+    assert cached.data == b''
+
+    changed = client.get('/api/analyze?lat=1.1&lon=1.1', headers={'If-None-Match': '"other"'})
+    assert changed.status_code == 200